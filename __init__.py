@@ -12,15 +12,15 @@ _panel = None
 
 _LOG_PATH = os.path.expanduser("~/ankihack_debug.log")
 
-def _log(msg):
-    with open(_LOG_PATH, "a") as f:
-        f.write(f"[ankihack] {msg}\n")
-
 # Route Python logging from ankihack.* to the debug log file
-logging.getLogger("ankihack").addHandler(
-    logging.FileHandler(_LOG_PATH, encoding="utf-8")
-)
-logging.getLogger("ankihack").setLevel(logging.DEBUG)
+log = logging.getLogger("ankihack")
+log.addHandler(logging.FileHandler(_LOG_PATH, encoding="utf-8"))
+log.setLevel(logging.DEBUG)
+
+
+def _log(msg):
+    # Goes through the long-lived FileHandler instead of reopening the file
+    log.debug("[ankihack] %s", msg)
 
 
 # ------------------------------------------------------------------
@@ -33,12 +33,20 @@ class _KeyFilter(QObject):
     so that Anki's reviewer shortcuts (Space/digits/Enter) still fire whenever
     focus is on any other panel widget (buttons, labels, scroll area, etc.).
     """
+    _ShortcutOverride = QEvent.Type.ShortcutOverride
+    _ChatInput = None  # imported lazily on the first ShortcutOverride
+
     def eventFilter(self, obj, event):
-        if event.type() == QEvent.Type.ShortcutOverride and _panel is not None:
+        # Runs for every event routed through mw — bail on the type check first.
+        if event.type() != self._ShortcutOverride or _panel is None:
+            return False
+        chat_input = self._ChatInput
+        if chat_input is None:
             from .qtui.chat_tab import ChatInput
-            if isinstance(mw.focusWidget(), ChatInput):
-                event.accept()
-                return True
+            chat_input = _KeyFilter._ChatInput = ChatInput
+        if isinstance(mw.focusWidget(), chat_input):
+            event.accept()
+            return True
         return False
 
 
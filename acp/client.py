@@ -8,9 +8,12 @@ Protocol reference: https://agentclientprotocol.com
 """
 
 from __future__ import annotations
+import io
+import itertools
 import json
 import logging
 import os
+import queue
 import subprocess
 import threading
 from typing import Callable, Optional
@@ -19,6 +22,45 @@ log = logging.getLogger("ankihack.acp")
 
 _STOP = object()
 
+# Block size for raw pipe reads and the buffered stdin writer
+_READ_SIZE = 65536
+
+# The agent's stderr goes straight to this file — no reader thread needed
+_STDERR_LOG_PATH = os.path.expanduser("~/ankihack_acp_stderr.log")
+
+_BASE_ENV: Optional[dict] = None
+_BASE_ENV_LOCK = threading.Lock()
+
+
+def _base_env() -> dict:
+    """os.environ with Homebrew paths prepended to PATH, computed once.
+
+    Anki.app launched from /Applications doesn't inherit the shell PATH,
+    so Homebrew binaries aren't found without this.
+    """
+    global _BASE_ENV
+    with _BASE_ENV_LOCK:
+        if _BASE_ENV is None:
+            extra_paths = ["/opt/homebrew/bin", "/usr/local/bin"]
+            env = dict(os.environ)
+            current_path = env.get("PATH", "")
+            current_parts = set(current_path.split(":"))
+            env["PATH"] = ":".join([p for p in extra_paths if p not in current_parts] + [current_path])
+            _BASE_ENV = env
+        return _BASE_ENV
+
+
+def _image_block(img: dict) -> dict:
+    """ACP image content block for an image dict, cached on the dict itself."""
+    block = img.get("_acp_block")
+    if block is None:
+        block = img["_acp_block"] = {
+            "type": "image",
+            "mimeType": img["media_type"],
+            "data": img["data"],
+        }
+    return block
+
 
 class ACPClient:
     def __init__(self, binary: str, env_extra: dict | None = None, args: list | None = None):
@@ -26,12 +68,17 @@ class ACPClient:
         self._env_extra = env_extra or {}
         self._args = args or []
         self._proc: Optional[subprocess.Popen] = None
-        self._req_id = 0
-        self._lock = threading.Lock()
-        self._pending: dict[int, dict] = {}          # id -> {event, result, error}
+        self._stdin: Optional[io.BufferedWriter] = None
+        # count.__next__ is atomic under the GIL — no lock needed for ids
+        self._next_id = itertools.count(1).__next__
+        self._pending: dict[int, queue.SimpleQueue] = {}  # id -> waiter for (result, error)
+        self._pending_lock = threading.Lock()        # guards _pending insert/remove only
         self._callbacks: dict[str, Callable] = {}    # session_id -> on_chunk
         self._sessions: dict[str, str] = {}          # session_key -> session_id
         self._supports_images: bool = False          # set from initialize response
+        # Encoder/decoder built once rather than per message
+        self._encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+        self._decode = json.JSONDecoder().decode
 
     # ------------------------------------------------------------------
     # Public API
@@ -39,29 +86,26 @@ class ACPClient:
 
     def start(self) -> Optional[str]:
         """Spawn the binary and handshake. Returns error string or None."""
-        env = {**os.environ, **self._env_extra}
-        # Anki.app launched from /Applications doesn't inherit the shell PATH,
-        # so Homebrew binaries aren't found. Prepend the common install locations.
-        extra_paths = ["/opt/homebrew/bin", "/usr/local/bin"]
-        current_path = env.get("PATH", "")
-        env["PATH"] = ":".join(p for p in extra_paths if p not in current_path) + ":" + current_path
+        env = {**_base_env(), **self._env_extra}
         try:
-            self._proc = subprocess.Popen(
-                [self._binary] + self._args,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=env,
-                text=True,
-                bufsize=1,
-            )
+            with open(_STDERR_LOG_PATH, "ab", buffering=0) as stderr_f:
+                self._proc = subprocess.Popen(
+                    [self._binary] + self._args,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr_f,
+                    env=env,
+                    bufsize=0,
+                )
         except FileNotFoundError:
             return f"ACP binary not found: {self._binary}"
         except Exception as e:
             return str(e)
 
+        # One buffered write + flush per message instead of raw pipe writes
+        self._stdin = io.BufferedWriter(self._proc.stdin, buffer_size=_READ_SIZE)
+
         threading.Thread(target=self._read_loop, daemon=True).start()
-        threading.Thread(target=self._stderr_loop, daemon=True).start()
 
         result, error = self._call("initialize", {
             "protocolVersion": 1,
@@ -77,26 +121,30 @@ class ACPClient:
         log.debug("[ACP] ready binary=%s supports_images=%s", self._binary, self._supports_images)
         return None
 
-    def get_or_create_session(self, session_key: Optional[str]) -> tuple[Optional[str], Optional[str]]:
-        """Return (session_id, error). Reuses cached session for same key."""
-        if session_key and session_key in self._sessions:
-            return self._sessions[session_key], None
+    def get_or_create_session(
+        self, session_key: Optional[str],
+    ) -> tuple[Optional[str], bool, Optional[str]]:
+        """Return (session_id, existing, error). Reuses cached session for same key."""
+        if session_key:
+            session_id = self._sessions.get(session_key)
+            if session_id is not None:
+                return session_id, True, None
 
         result, error = self._call("session/new", {
             "cwd": os.path.expanduser("~"),
             "mcpServers": [],
         })
         if error:
-            return None, f"session/new failed: {error}"
+            return None, False, f"session/new failed: {error}"
 
         session_id = result.get("sessionId") if result else None
         if not session_id:
-            return None, "No sessionId in session/new response"
+            return None, False, "No sessionId in session/new response"
 
         if session_key:
             self._sessions[session_key] = session_id
         log.debug("[ACP] new session=%s key=%s", session_id, session_key)
-        return session_id, None
+        return session_id, False, None
 
     def send_prompt(
         self,
@@ -107,47 +155,51 @@ class ACPClient:
         on_error: Callable[[str], None],
         images: list | None = None,
     ):
-        """Send prompt non-blocking. Streams chunks via on_chunk."""
+        """Send prompt and block until the turn finishes or times out.
+
+        Streams chunks via on_chunk, then calls on_done or on_error — all on
+        the calling thread, which must therefore be a background thread.
+        """
         self._callbacks[session_id] = on_chunk
 
-        def _worker():
-            req_id = self._next_id()
-            event = threading.Event()
-            self._pending[req_id] = {"event": event, "result": None, "error": None}
-
-            prompt_blocks = []
-            if self._supports_images:
-                for img in (images or []):
-                    prompt_blocks.append({
-                        "type": "image",
-                        "mimeType": img["media_type"],
-                        "data": img["data"],
-                    })
-            prompt_blocks.append({"type": "text", "text": text})
-
-            self._send({
-                "jsonrpc": "2.0",
-                "id": req_id,
-                "method": "session/prompt",
-                "params": {
-                    "sessionId": session_id,
-                    "prompt": prompt_blocks,
-                },
-            })
-            log.debug("[ACP] prompt sent session=%s req=%s", session_id, req_id)
-
-            timed_out = not event.wait(timeout=180)
-            self._callbacks.pop(session_id, None)
-            entry = self._pending.pop(req_id, {})
-
-            if timed_out:
-                on_error("Timeout waiting for response")
-            elif entry.get("error"):
-                on_error(str(entry["error"]))
-            else:
-                on_done()
+        req_id = self._next_id()
+        waiter = queue.SimpleQueue()
+        with self._pending_lock:
+            self._pending[req_id] = waiter
+
+        prompt_blocks = [_image_block(img) for img in images] if (
+            images and self._supports_images
+        ) else []
+        prompt_blocks.append({"type": "text", "text": text})
+
+        self._send({
+            "jsonrpc": "2.0",
+            "id": req_id,
+            "method": "session/prompt",
+            "params": {
+                "sessionId": session_id,
+                "prompt": prompt_blocks,
+            },
+        })
+        log.debug("[ACP] prompt sent session=%s req=%s", session_id, req_id)
 
-        threading.Thread(target=_worker, daemon=True).start()
+        try:
+            _result, error = waiter.get(timeout=180)
+        except queue.Empty:
+            error = None
+            timed_out = True
+        else:
+            timed_out = False
+        self._callbacks.pop(session_id, None)
+        with self._pending_lock:
+            self._pending.pop(req_id, None)
+
+        if timed_out:
+            on_error("Timeout waiting for response")
+        elif error:
+            on_error(str(error))
+        else:
+            on_done()
 
     def close(self):
         if self._proc:
@@ -161,80 +213,85 @@ class ACPClient:
     # Internal
     # ------------------------------------------------------------------
 
-    def _next_id(self) -> int:
-        with self._lock:
-            self._req_id += 1
-            return self._req_id
-
     def _send(self, msg: dict):
-        if self._proc and self._proc.stdin:
+        if self._stdin:
+            payload = self._encode(msg).encode() + b"\n"
             try:
-                self._proc.stdin.write(json.dumps(msg) + "\n")
-                self._proc.stdin.flush()
+                self._stdin.write(payload)
+                self._stdin.flush()
             except Exception as e:
                 log.error("[ACP] send error: %s", e)
 
     def _call(self, method: str, params: dict) -> tuple[Optional[dict], Optional[str]]:
         """Synchronous JSON-RPC call — blocks until response or timeout."""
         req_id = self._next_id()
-        event = threading.Event()
-        self._pending[req_id] = {"event": event, "result": None, "error": None}
+        waiter = queue.SimpleQueue()
+        with self._pending_lock:
+            self._pending[req_id] = waiter
         self._send({"jsonrpc": "2.0", "id": req_id, "method": method, "params": params})
-        event.wait(timeout=30)
-        entry = self._pending.pop(req_id, {})
-        return entry.get("result"), entry.get("error")
+        try:
+            return waiter.get(timeout=30)
+        except queue.Empty:
+            return None, None
+        finally:
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
 
     def _read_loop(self):
-        """Background thread: read stdout and dispatch."""
+        """Background thread: read stdout in large blocks and dispatch each
+        newline-delimited frame. Only complete frames are decoded."""
+        # Hot loop — bind attribute lookups to locals once
+        read = os.read
+        decode = self._decode
+        dispatch = self._dispatch
         try:
-            for line in self._proc.stdout:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    msg = json.loads(line)
-                except json.JSONDecodeError:
-                    log.warning("[ACP] bad JSON: %s", line[:100])
-                    continue
-                self._dispatch(msg)
+            fd = self._proc.stdout.fileno()
+            buf = bytearray()
+            while True:
+                chunk = read(fd, _READ_SIZE)
+                if not chunk:
+                    break
+                buf += chunk
+                while (nl := buf.find(b"\n")) != -1:
+                    frame = bytes(buf[:nl]).strip()
+                    del buf[:nl + 1]
+                    if not frame:
+                        continue
+                    try:
+                        msg = decode(frame.decode())
+                    except ValueError:
+                        log.warning("[ACP] bad JSON: %s", frame[:100])
+                        continue
+                    dispatch(msg)
         except Exception as e:
             log.error("[ACP] read_loop: %s", e)
 
-    def _stderr_loop(self):
-        """Background thread: log stderr."""
-        try:
-            for line in self._proc.stderr:
-                line = line.rstrip()
-                if line:
-                    log.warning("[ACP stderr] %s", line)
-        except Exception:
-            pass
-
     def _dispatch(self, msg: dict):
-        msg_id = msg.get("id")
-        method = msg.get("method")
-
-        # Streaming notification
-        if method == "session/update":
-            params = msg.get("params", {})
-            session_id = params.get("sessionId")
-            update = params.get("update", {})
-            update_type = update.get("sessionUpdate")
-
-            if update_type == "agent_message_chunk":
-                content = update.get("content", {})
-                text = content.get("text", "") if isinstance(content, dict) else ""
-                if text:
-                    cb = self._callbacks.get(session_id)
-                    if cb:
-                        cb(text)
+        # Streaming notification — by far the most frequent message, so it
+        # is checked first and dropped as early as possible.
+        if msg.get("method") == "session/update":
+            params = msg.get("params") or {}
+            cb = self._callbacks.get(params.get("sessionId"))
+            if cb is None:
+                return
+            update = params.get("update") or {}
+            if update.get("sessionUpdate") != "agent_message_chunk":
+                return
+            content = update.get("content")
+            text = content.get("text", "") if isinstance(content, dict) else ""
+            if text:
+                cb(text)
             return
 
         # Response to a request
-        if msg_id is not None and msg_id in self._pending:
-            entry = self._pending[msg_id]
+        msg_id = msg.get("id")
+        if msg_id is None:
+            return
+        with self._pending_lock:
+            waiter = self._pending.get(msg_id)
+        # Wake the waiter outside the lock to keep the critical section short
+        if waiter is not None:
             if "error" in msg:
-                entry["error"] = msg["error"].get("message", str(msg["error"]))
+                waiter.put((None, msg["error"].get("message", str(msg["error"]))))
             else:
-                entry["result"] = msg.get("result")
-            entry["event"].set()
+                waiter.put((msg.get("result"), None))
@@ -7,7 +7,9 @@ from __future__ import annotations
 import threading
 from typing import Callable
 
-_acp_clients: dict[str, object] = {}   # cache_key -> ACPClient
+_acp_clients: dict[tuple, object] = {}   # cache_key -> ACPClient
+_acp_clients_lock = threading.Lock()
+_acp_starting: dict[tuple, threading.Event] = {}   # cache_key -> set when start() finishes
 
 
 def ask_ai_async(
@@ -40,8 +42,6 @@ def ask_ai_async(
 def _ask_via_acp(system_prompt, card_context, user_question, config,
                  on_chunk, on_done, on_error, session_key=None, images=None,
                  cancel_event=None):
-    from .acp import ACPClient
-
     harness = config.get("harness", "claude-acp")
     extra_args = []
 
@@ -62,39 +62,37 @@ def _ask_via_acp(system_prompt, card_context, user_question, config,
         if key:
             env_extra["OPENAI_API_KEY"] = key
 
-    cache_key = f"{binary}:{':'.join(extra_args)}"
+    cache_key = (binary, tuple(extra_args), tuple(sorted(env_extra.items())))
 
     def _worker():
-        client = _acp_clients.get(cache_key)
-        if client is None:
-            client = ACPClient(binary, env_extra, args=extra_args)
-            err = client.start()
-            if err:
-                on_error(err)
-                return
-            _acp_clients[cache_key] = client
-
-        existing = session_key in client._sessions if session_key else False
-
-        session_id, err = client.get_or_create_session(session_key)
+        client, err = _get_acp_client(cache_key, binary, env_extra, extra_args)
+        if err:
+            on_error(err)
+            return
+
+        session_id, existing, err = client.get_or_create_session(session_key)
         if err:
             on_error(err)
             return
 
+        # The system prompt and card context only go out on a session's first
+        # turn; later turns on the same session send just the question.
+        full_prompt = f"Fråga: {user_question}"
         if not existing and (system_prompt or card_context):
-            full_prompt = system_prompt + "\n\n"
-            if card_context:
-                full_prompt += card_context + "\n\n"
-            full_prompt += f"Fråga: {user_question}"
-        else:
-            full_prompt = f"Fråga: {user_question}"
+            parts = [system_prompt, card_context, full_prompt] if card_context \
+                else [system_prompt, full_prompt]
+            full_prompt = "\n\n".join(parts)
 
         prompt_images = images if (not existing and images) else None
 
-        def _on_chunk_guarded(chunk):
-            if cancel_event and cancel_event.is_set():
-                return
-            on_chunk(chunk)
+        if cancel_event is None:
+            _on_chunk_guarded = on_chunk
+        else:
+            is_cancelled = cancel_event.is_set
+
+            def _on_chunk_guarded(chunk):
+                if not is_cancelled():
+                    on_chunk(chunk)
 
         client.send_prompt(
             session_id=session_id,
@@ -105,4 +103,40 @@ def _ask_via_acp(system_prompt, card_context, user_question, config,
             images=prompt_images,
         )
 
+    # Daemon thread, not a pool: send_prompt can block for minutes and pool
+    # workers are joined at exit, which would stall Anki's shutdown.
     threading.Thread(target=_worker, daemon=True).start()
+
+
+def _get_acp_client(cache_key, binary, env_extra, extra_args):
+    """Return (client, error) for cache_key, starting at most one client.
+
+    Concurrent callers for the same key wait for the first caller's start()
+    instead of each spawning (and leaking) their own subprocess.
+    """
+    from .acp import ACPClient
+
+    while True:
+        with _acp_clients_lock:
+            client = _acp_clients.get(cache_key)
+            if client is not None:
+                return client, None
+            starting = _acp_starting.get(cache_key)
+            owner = starting is None
+            if owner:
+                starting = _acp_starting[cache_key] = threading.Event()
+        if not owner:
+            starting.wait()
+            continue
+
+        client = ACPClient(binary, env_extra, args=extra_args)
+        err = client.start()
+        with _acp_clients_lock:
+            if not err:
+                _acp_clients[cache_key] = client
+            _acp_starting.pop(cache_key, None)
+        starting.set()
+        if err:
+            client.close()
+            return None, err
+        return client, None
@@ -1,137 +1,357 @@
 """
 Local lecture slide search — queries the SQLite FTS5 index built by index.py.
-Supports single keyword search and MCQ card search (RRF fusion).
+Supports single keyword search and MCQ card search (one fused BM25 query,
+or RRF fusion of per-option queries when ACP_RRF=1).
 """
 from __future__ import annotations
+import atexit
+import heapq
+import os
 import re
 import sqlite3
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
 
 DB_PATH = Path("/Users/johandahlin/dev/ankihack") / "search.db"
 
+# Read-only search workload: bigger page cache and mmap'd reads. Nothing
+# here changes the index file itself (it belongs to index.py).
+_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA case_sensitive_like=OFF",
+)
+
+# (monotonic time of last stat, index mtime or None) — see _db_mtime
+_DB_STAT_TTL = 5.0
+_db_stat: tuple[float, float | None] = (float("-inf"), None)
+
+# One connection shared by all search threads; _CONN_LOCK serializes its use.
+# _CONN_ID is the index's (st_ino, st_mtime_ns) when _CONN was opened.
+_CONN: sqlite3.Connection | None = None
+_CONN_ID: tuple[int, int] | None = None
+_CONN_LOCK = threading.Lock()
+
+# MCQ search mode. Question and options hit one corpus with one BM25
+# weighting, so a single OR'd MATCH ranks about as well as fusing per-option
+# rankings; ACP_RRF=1 restores the RRF path.
+_RRF_MODE = os.environ.get("ACP_RRF") == "1"
+
 # RRF smoothing constant
 _RRF_K = 60
+# RRF weight 1/(K + rank + 1) per 0-based rank; per-query result lists are far
+# shorter than this, so deeper ranks are simply not scored
+_RRF_W = tuple(1.0 / (_RRF_K + rank + 1) for rank in range(1024))
 
 # Lecture name substrings that are never useful as search results
 _EXCLUDE = ("instudering", "seminarieuppgift", "seminareuppgift", "seminaruppgift")
+# ...applied in SQL so excluded rows never count against LIMIT (LIKE is
+# case-insensitive for ASCII, matching the old lower()-based filter)
+_EXCLUDE_SQL = " AND ".join("coalesce(s.lecture, '') NOT LIKE ?" for _ in _EXCLUDE)
+_EXCLUDE_PARAMS = tuple(f"%{x}%" for x in _EXCLUDE)
+
+# _sanitize: characters replaced by spaces, and tokens never worth searching
+_NONWORD_RE = re.compile(r'[^\w\såäöÅÄÖ]')
+# Same mapping as _NONWORD_RE for ASCII-only text, applied with str.translate
+_ASCII_NONWORD = {i: ' ' for i in range(128) if _NONWORD_RE.match(chr(i))}
+_STOPS = frozenset({
+    # Swedish function words
+    'och', 'att', 'det', 'den', 'en', 'ett', 'är', 'av', 'om', 'för',
+    'på', 'med', 'som', 'till', 'från', 'kan', 'de', 'i', 'vad', 'har',
+    'var', 'sig', 'men', 'så', 'när', 'hur', 'där', 'här', 'inte',
+    'alla', 'also', 'bara', 'dels', 'dock', 'även', 'samt', 'utan',
+    'eller', 'sedan', 'inom', 'över', 'under', 'efter', 'igen', 'deras',
+    'dess', 'vid', 'mot', 'hos', 'via', 'sina', 'sitt', 'hela', 'just',
+    'ofta', 'vilken', 'vilket', 'vilka', 'sant', 'falskt',
+    # Generic verbs/adverbs that carry no medical meaning
+    'gör', 'göra', 'leder', 'sker', 'finns', 'inga', 'olika', 'andra',
+    'detta', 'dessa', 'istället', 'iväg', 'skickas', 'stannar',
+    # English stop words
+    'the', 'of', 'in', 'a', 'an', 'or', 'and', 'is', 'are', 'that',
+    'this', 'with', 'from', 'which', 'what', 'when', 'where', 'how',
+})
+
+# parse_mcq: HTML → plain text, then option markers
+# One pass over tags: block-level tags (group 1) become newlines, others vanish
+_TAG_RE = re.compile(r'<(?:(br|p|div|li|tr)[^>]*|[^>]+)>', re.IGNORECASE)
+# Runs of spaces, tabs and &nbsp; collapse to a single space
+_HSPACE_RE = re.compile(r'(?:[ \t]|&nbsp;)+')
+_MULTI_NL_RE = re.compile(r'\n{3,}')
+# Option markers: a) b) c) / A. B. / 1) 2) at line start or after newline
+_OPTION_RE = re.compile(r'(?:^|\n)\s*([a-dA-D1-4])[).]\s+(.+)', re.MULTILINE)
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Return the shared read-only connection, opening and tuning it on first
+    use and reopening it when the index file is rebuilt or replaced.
+    Callers must hold _CONN_LOCK."""
+    global _CONN, _CONN_ID
+    st = DB_PATH.stat()
+    conn_id = (st.st_ino, st.st_mtime_ns)
+    if _CONN is not None and _CONN_ID != conn_id:
+        _CONN.close()
+        _CONN = None
+    if _CONN is None:
+        con = sqlite3.connect(
+            f"{DB_PATH.as_uri()}?mode=ro", uri=True,
+            check_same_thread=False, cached_statements=256,
+        )
+        for pragma in _PRAGMAS:
+            con.execute(pragma)
+        _CONN, _CONN_ID = con, conn_id
+    return _CONN
 
 
-def _excluded(slide: dict) -> bool:
-    lecture = (slide.get("lecture") or "").lower()
-    return any(x in lecture for x in _EXCLUDE)
+@atexit.register
+def _close_conn():
+    global _CONN, _CONN_ID
+    with _CONN_LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = _CONN_ID = None
 
 
+@lru_cache(maxsize=2048)
 def _sanitize(text: str, max_tokens: int = 6) -> str:
-    text = re.sub(r'[^\w\såäöÅÄÖ]', ' ', text, flags=re.UNICODE)
-    stops = {
-        # Swedish function words
-        'och', 'att', 'det', 'den', 'en', 'ett', 'är', 'av', 'om', 'för',
-        'på', 'med', 'som', 'till', 'från', 'kan', 'de', 'i', 'vad', 'har',
-        'var', 'sig', 'men', 'så', 'när', 'hur', 'där', 'här', 'inte',
-        'alla', 'also', 'bara', 'dels', 'dock', 'även', 'samt', 'utan',
-        'eller', 'sedan', 'inom', 'över', 'under', 'efter', 'igen', 'deras',
-        'dess', 'vid', 'mot', 'hos', 'via', 'sina', 'sitt', 'hela', 'just',
-        'ofta', 'vilken', 'vilket', 'vilka', 'sant', 'falskt',
-        # Generic verbs/adverbs that carry no medical meaning
-        'gör', 'göra', 'leder', 'sker', 'finns', 'inga', 'olika', 'andra',
-        'detta', 'dessa', 'istället', 'iväg', 'skickas', 'stannar',
-        # English stop words
-        'the', 'of', 'in', 'a', 'an', 'or', 'and', 'is', 'are', 'that',
-        'this', 'with', 'from', 'which', 'what', 'when', 'where', 'how',
-    }
+    if text.isascii():
+        text = text.translate(_ASCII_NONWORD)
+    else:
+        text = _NONWORD_RE.sub(' ', text)
     tokens = []
     for t in text.split():
         tl = t.lower()
-        if tl in stops:
+        if tl in _STOPS:
             continue
         # Keep short all-uppercase tokens — these are medical abbreviations (ER, ATP, DNA, mRNA…)
         if t.isupper() and len(t) >= 2:
             tokens.append(t)
         elif len(t) > 3:
             tokens.append(t)
-    tokens = sorted(set(tokens), key=lambda t: -len(t))[:max_tokens]
+    tokens = heapq.nlargest(max_tokens, set(tokens), key=len)
     return ' OR '.join(tokens)
 
 
+# SQL texts are fixed per shape so sqlite3's statement cache reuses the plans
+_SEARCH_SQL = """
+    SELECT
+        s.id, s.del, s.block, s.lecture, s.slide_num,
+        s.slide_txt, s.ai_txt, s.key_terms, s.png_path,
+        bm25(slides_fts, 0, 0, 0, 5.0, 1.0, 50.0) AS score
+    FROM slides_fts
+    JOIN slides s ON slides_fts.rowid = s.id
+    WHERE slides_fts MATCH ? AND """ + _EXCLUDE_SQL + """
+    ORDER BY score
+    LIMIT ?
+"""
+
+
 def _run_query(cur: sqlite3.Cursor, query: str, limit: int) -> list:
-    clean = _sanitize(query)
+    return _run_match(cur, _sanitize(query), limit)
+
+
+def _run_match(cur: sqlite3.Cursor, clean: str, limit: int) -> list:
     if not clean:
         return []
     try:
-        cur.execute("""
-            SELECT
-                s.id, s.del, s.block, s.lecture, s.slide_num,
-                s.slide_txt, s.ai_txt, s.key_terms, s.png_path,
-                bm25(slides_fts, 0, 0, 0, 5.0, 1.0, 50.0) AS score
-            FROM slides_fts
-            JOIN slides s ON slides_fts.rowid = s.id
-            WHERE slides_fts MATCH ?
-            ORDER BY score
-            LIMIT ?
-        """, (clean, limit))
-        return cur.fetchall()
+        return list(cur.execute(_SEARCH_SQL, (clean, *_EXCLUDE_PARAMS, limit)))
     except sqlite3.OperationalError:
         return []
 
 
-def _rrf_merge(query_results: list[tuple[str, list]]) -> list[dict]:
-    scores: dict[int, float] = {}
-    data: dict[int, dict] = {}
-    matched: dict[int, list[str]] = {}
+# One ranked FTS5 subquery of the MCQ compound statement; the label column
+# lets rows from all subqueries come back in a single result set. Only ids
+# are fetched for ranking — survivors are hydrated by _hydrate afterwards.
+_MCQ_SUBQUERY = """
+    SELECT * FROM (
+        SELECT
+            ? AS lbl,
+            s.id,
+            bm25(slides_fts, 0, 0, 0, 5.0, 1.0, 50.0) AS score
+        FROM slides_fts
+        JOIN slides s ON slides_fts.rowid = s.id
+        WHERE slides_fts MATCH ? AND """ + _EXCLUDE_SQL + """
+        ORDER BY score
+        LIMIT ?
+    )
+"""
 
-    for label, rows in query_results:
-        for rank, row in enumerate(rows):
-            sid = row[0]
-            scores[sid] = scores.get(sid, 0.0) + 1.0 / (_RRF_K + rank + 1)
-            matched.setdefault(sid, []).append(label)
-            if sid not in data:
-                data[sid] = dict(
-                    id=row[0], del_=row[1], block=row[2], lecture=row[3],
-                    slide_num=row[4], slide_txt=row[5], ai_txt=row[6],
-                    key_terms=row[7], png_path=row[8],
-                )
 
+@lru_cache(maxsize=None)
+def _mcq_sql(n: int) -> str:
+    return " UNION ALL ".join([_MCQ_SUBQUERY] * n)
+
+
+def _run_queries(cur: sqlite3.Cursor, labelled: list[tuple[str, str]], limit: int) -> list[tuple[str, list]]:
+    """Run several labelled queries in one UNION ALL round-trip.
+
+    Returns [(label, [(id, score), ...]), ...] in input order, skipping
+    empty results. Falls back to one query per label if the compound
+    statement fails (e.g. a token that FTS5 parses as an operator).
+    """
+    clean = [(label, _sanitize(text)) for label, text in labelled]
+    clean = [(label, c) for label, c in clean if c]
+    if not clean:
+        return []
+    buckets: dict[str, list] = {label: [] for label, _ in clean}
+
+    def _collect(sql, params):
+        # Bucket straight off the cursor — no intermediate fetchall() list
+        for lbl, sid, score in cur.execute(sql, params):
+            buckets[lbl].append((sid, score))
+
+    try:
+        _collect(
+            _mcq_sql(len(clean)),
+            [p for label, c in clean for p in (label, c, *_EXCLUDE_PARAMS, limit)],
+        )
+    except sqlite3.OperationalError:
+        for bucket in buckets.values():
+            bucket.clear()
+        for label, c in clean:
+            try:
+                _collect(_mcq_sql(1), (label, c, *_EXCLUDE_PARAMS, limit))
+            except sqlite3.OperationalError:
+                pass
     results = []
-    for sid, rrf in sorted(scores.items(), key=lambda x: -x[1]):
-        d = dict(data[sid])
-        d["rrf_score"] = rrf
-        d["matched_by"] = matched[sid]
-        results.append(d)
+    for label, rows in buckets.items():
+        if rows:
+            rows.sort(key=lambda r: r[-1])
+            results.append((label, rows))
     return results
 
 
-def search_slides(query: str, limit: int = 8) -> list[dict]:
-    """Single-query search. Returns list of slide dicts sorted by relevance."""
-    if not DB_PATH.exists():
+class Slide(NamedTuple):
+    """One lecture slide search hit."""
+    id: int
+    del_: str
+    block: str
+    lecture: str
+    slide_num: int
+    slide_txt: str
+    ai_txt: str
+    key_terms: str
+    png_path: str
+    rrf_score: float | None
+    matched_by: tuple[str, ...]
+
+
+def _slide(row, rrf_score: float | None, matched_by) -> Slide:
+    # row may carry a trailing bm25 score column; only the slide columns are kept
+    return Slide(*row[:9], rrf_score, tuple(matched_by))
+
+
+def _rrf_merge(query_results: list[tuple[str, list]], limit: int) -> list[tuple[int, float, list[str]]]:
+    """Fuse ranked id lists by RRF score.
+
+    Returns the top `limit` as (id, rrf_score, matched_by) tuples.
+    """
+    scores: defaultdict[int, float] = defaultdict(float)
+    matched: defaultdict[int, list[str]] = defaultdict(list)
+
+    for label, rows in query_results:
+        for weight, row in zip(_RRF_W, rows):
+            sid = row[0]
+            scores[sid] += weight
+            matched[sid].append(label)
+
+    top = sorted(scores.items(), key=lambda x: -x[1])[:limit]
+    return [(sid, rrf, matched[sid]) for sid, rrf in top]
+
+
+@lru_cache(maxsize=None)
+def _hydrate_sql(n: int) -> str:
+    return (
+        "SELECT id, del, block, lecture, slide_num, slide_txt, ai_txt, key_terms, png_path"
+        " FROM slides WHERE id IN (" + ",".join("?" * n) + ")"
+    )
+
+
+def _hydrate(cur: sqlite3.Cursor, ranked: list[tuple[int, float, list[str]]]) -> list[Slide]:
+    """Fetch full rows for the ranked survivors in one query, keeping rank order."""
+    if not ranked:
+        return []
+    rows = {r[0]: r for r in cur.execute(_hydrate_sql(len(ranked)), [sid for sid, _, _ in ranked])}
+    return [_slide(rows[sid], rrf, matched)
+            for sid, rrf, matched in ranked if sid in rows]
+
+
+def _db_mtime() -> float | None:
+    """Index mtime, or None if there is no index. Part of the result-cache
+    key so a rebuilt index is never answered from stale results.
+
+    The stat() is reused for _DB_STAT_TTL seconds, so a run of lookups
+    during review costs at most one syscall per interval.
+    """
+    global _db_stat
+    now = time.monotonic()
+    checked_at, mtime = _db_stat
+    if now - checked_at < _DB_STAT_TTL:
+        return mtime
+    try:
+        mtime = DB_PATH.stat().st_mtime
+    except OSError:
+        mtime = None
+    _db_stat = (now, mtime)
+    return mtime
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def search_slides(query: str, limit: int = 8) -> list[Slide]:
+    """Single-query search. Returns Slide records sorted by relevance."""
+    mtime = _db_mtime()
+    if mtime is None:
         return []
-    con = sqlite3.connect(str(DB_PATH))
-    cur = con.cursor()
-    rows = _run_query(cur, query, limit)
-    con.close()
-    results = [
-        dict(id=r[0], del_=r[1], block=r[2], lecture=r[3], slide_num=r[4],
-             slide_txt=r[5], ai_txt=r[6], key_terms=r[7], png_path=r[8],
-             rrf_score=None, matched_by=["query"])
-        for r in rows
-    ]
-    return [s for s in results if not _excluded(s)]
-
-
-def search_mcq(question: str, answers: list[str], limit: int = 8) -> list[dict]:
-    """MCQ search: fuse results from question + each answer via RRF."""
-    if not DB_PATH.exists():
+    return list(_search_slides_cached(_normalize(query), limit, mtime))
+
+
+def search_mcq(question: str, answers: list[str], limit: int = 8) -> list[Slide]:
+    """MCQ search over the question and every answer option. Returns Slide
+    records sorted by relevance."""
+    mtime = _db_mtime()
+    if mtime is None:
         return []
-    con = sqlite3.connect(str(DB_PATH))
-    cur = con.cursor()
+    key = (_normalize(question), tuple(_normalize(a) for a in answers))
+    return list(_search_mcq_cached(*key, limit, mtime))
+
+
+@lru_cache(maxsize=512)
+def _search_slides_cached(query: str, limit: int, _mtime: float) -> tuple[Slide, ...]:
+    with _CONN_LOCK:
+        rows = _run_query(_get_conn().cursor(), query, limit)
+    return tuple(_slide(r, None, ["query"]) for r in rows)
+
+
+@lru_cache(maxsize=512)
+def _search_mcq_cached(question: str, answers: tuple[str, ...], limit: int, _mtime: float) -> tuple[Slide, ...]:
+    if not _RRF_MODE:
+        # Quoted so tokens such as NOT/AND are matched as words, not operators
+        terms = dict.fromkeys(
+            f'"{t}"' for text in (question, *answers)
+            for t in _sanitize(text).split(" OR ") if t
+        )
+        with _CONN_LOCK:
+            rows = _run_match(_get_conn().cursor(), " OR ".join(terms), limit)
+        return tuple(_slide(r, None, ["mcq"]) for r in rows)
+
     per_query = max(limit, 20)
-    query_results = []
-    for label, text in [("question", question)] + [(f"answer_{i+1}", a) for i, a in enumerate(answers)]:
-        rows = _run_query(cur, text, per_query)
-        if rows:
-            query_results.append((label, rows))
-    con.close()
-    merged = _rrf_merge(query_results)
-    return [s for s in merged if not _excluded(s)][:limit]
+    labelled = [("question", question)] + [(f"answer_{i+1}", a) for i, a in enumerate(answers)]
+    with _CONN_LOCK:
+        cur = _get_conn().cursor()
+        ranked = _rrf_merge(_run_queries(cur, labelled, per_query), limit)
+        return tuple(_hydrate(cur, ranked))
+
+
+def _tag_repl(m: re.Match) -> str:
+    return '\n' if m.group(1) else ''
 
 
 def parse_mcq(card_html: str) -> tuple[str, list[str]] | None:
@@ -140,20 +360,17 @@ def parse_mcq(card_html: str) -> tuple[str, list[str]] | None:
     Returns (question, [answer_a, answer_b, ...]) or None if not MCQ format.
     """
     # Replace block-level tags with newlines to preserve structure
-    text = re.sub(r'<(?:br|p|div|li|tr)[^>]*>', '\n', card_html, flags=re.IGNORECASE)
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'&nbsp;', ' ', text)
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n{3,}', '\n\n', text).strip()
+    text = _TAG_RE.sub(_tag_repl, card_html)
+    text = _HSPACE_RE.sub(' ', text)
+    text = _MULTI_NL_RE.sub('\n\n', text).strip()
 
     # Match option markers: a) b) c) / A. B. / 1) 2) at line start or after newline
-    option_re = re.compile(r'(?:^|\n)\s*([a-dA-D1-4])[).]\s+(.+)', re.MULTILINE)
-    matches = option_re.findall(text)
+    matches = _OPTION_RE.findall(text)
     if len(matches) < 2:
         return None
 
     # Question = everything before the first option
-    first_match = option_re.search(text)
+    first_match = _OPTION_RE.search(text)
     question = text[:first_match.start()].replace('\n', ' ').strip()
     if not question:
         return None
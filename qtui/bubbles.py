@@ -1,14 +1,15 @@
-"""Chat bubble widgets: BlurOverlay, UserBubble, AiBubble."""
+"""Chat bubble widgets: BlurOverlay, UserBubble, AiBubble, BubblePlaceholder."""
 from __future__ import annotations
 import html as html_module
 
-from aqt import mw
+from aqt import mw, dialogs
 from aqt.qt import (
     QWidget, QHBoxLayout, QVBoxLayout, QLabel, QTextBrowser,
     QPushButton, QFrame, QSizePolicy, Qt, QTimer, QDesktopServices,
+    QPalette, QTextCursor, QApplication,
 )
 
-from .markdown import md_to_html
+from .markdown import CHAT_CSS
 
 
 class BlurOverlay(QWidget):
@@ -79,7 +80,6 @@ class AiBubble(QWidget):
         outer.setContentsMargins(6, 2, 40, 2)
 
         frame = QFrame()
-        from aqt.qt import QPalette
         alt = mw.palette().color(QPalette.ColorRole.AlternateBase).name()
         frame.setStyleSheet(f"QFrame {{ background: {alt}; border-radius: 14px; }}")
         frame_layout = QVBoxLayout(frame)
@@ -111,7 +111,15 @@ class AiBubble(QWidget):
         self._browser.setStyleSheet("background: transparent; border: none;")
         self._browser.viewport().setStyleSheet("background: transparent;")
         self._browser.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
-        self._browser.document().contentsChanged.connect(self._fit_height)
+        self._browser.document().setDefaultStyleSheet(CHAT_CSS)
+        # Bursts of content changes collapse into one layout per frame.
+        self._fit_timer = QTimer(self)
+        self._fit_timer.setSingleShot(True)
+        self._fit_timer.setInterval(16)
+        self._fit_timer.timeout.connect(self._do_fit_height)
+        self._browser.document().contentsChanged.connect(self._on_contents_changed)
+        self._content_gen = 0
+        self._last_fit = None  # (bubble width, content generation) of the last fit
         frame_layout.addWidget(self._browser)
 
         # Optional "update card" button shown at the bottom of the bubble
@@ -127,6 +135,7 @@ class AiBubble(QWidget):
 
         self._raw = ""
         self._on_update_card = None
+        self._tail_pos = 0  # document position where the streamed tail starts
 
     def show_update_button(self, callback):
         self._on_update_card = callback
@@ -141,12 +150,35 @@ class AiBubble(QWidget):
 
     def set_html(self, html: str, raw: str = ""):
         self._raw = raw
+        self._tail_pos = 0
         cursor = self._browser.textCursor()
         self._browser.setHtml(html)
         self._browser.setTextCursor(cursor)
 
+    def append_html(self, html: str):
+        """Replace the streamed tail with finished HTML and start a new tail.
+
+        Completed paragraphs are inserted once via a QTextCursor, so only the
+        unfinished tail is re-parsed on each streamed update.
+        """
+        cursor = self._tail_cursor()
+        cursor.insertHtml(html)
+        cursor.insertBlock()
+        self._tail_pos = cursor.position()
+
+    def set_tail_html(self, html: str, raw: str = ""):
+        """Replace everything after the last append_html() with html."""
+        self._raw = raw
+        self._tail_cursor().insertHtml(html)
+
+    def _tail_cursor(self):
+        cursor = QTextCursor(self._browser.document())
+        cursor.setPosition(self._tail_pos)
+        cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+        return cursor
+
     def _copy_text(self):
-        from aqt.qt import QApplication
         QApplication.clipboard().setText(self._raw)
         self._copy_btn.setText("✓")
         QTimer.singleShot(1500, lambda: self._copy_btn.setText("⎘"))
@@ -155,7 +187,6 @@ class AiBubble(QWidget):
         if url.scheme() == "anki" and url.host() == "note":
             try:
                 nid = int(url.path().lstrip("/"))
-                from aqt import dialogs
                 browser = dialogs.open("Browser", mw)
                 browser.search_for(f"nid:{nid}")
             except Exception:
@@ -165,9 +196,13 @@ class AiBubble(QWidget):
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self._fit_height()
+        self._do_fit_height()  # fit immediately so manual resizes don't lag a frame
+
+    def _on_contents_changed(self):
+        self._content_gen += 1
+        self._fit_timer.start()
 
-    def _fit_height(self):
+    def _do_fit_height(self):
         # Derive text width from the bubble's own width minus all layout margins:
         #   outer HBoxLayout: left=6, right=40
         #   frame VBoxLayout: left=10, right=10  → total = 66
@@ -178,6 +213,26 @@ class AiBubble(QWidget):
         if text_width <= 0:
             return
         doc = self._browser.document()
+        key = (bw, self._content_gen)
+        if key == self._last_fit:
+            return
+        self._last_fit = key
         doc.setTextWidth(text_width)
         h = int(doc.size().height()) + 4
         self._browser.setFixedHeight(max(h, 24))
+
+
+class BubblePlaceholder(QWidget):
+    """Fixed-height stand-in for a history message that is not built yet.
+
+    ChatTab swaps it for a real UserBubble/AiBubble once it scrolls near
+    the viewport.
+    """
+
+    HEIGHT = 40
+
+    def __init__(self, is_user: bool, raw: str, parent=None):
+        super().__init__(parent)
+        self.is_user = is_user
+        self.raw = raw
+        self.setFixedHeight(self.HEIGHT)
@@ -1,18 +1,44 @@
 """Chat tab widget and supporting chat input widget."""
 from __future__ import annotations
+import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from aqt import mw
 from aqt.qt import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPlainTextEdit,
     QPushButton, QComboBox, QScrollArea, QGraphicsBlurEffect,
-    Qt, QEvent, QTimer,
+    Qt, QEvent, QTimer, QPalette,
 )
 
-from .bubbles import BlurOverlay, UserBubble, AiBubble
+from .bubbles import BlurOverlay, UserBubble, AiBubble, BubblePlaceholder
 from .db import ChatDB
-from .markdown import md_to_html
+from .markdown import md_to_html, md_to_fragment_html, clear_md_cache
+
+_RENDER_INTERVAL_MS = 30   # coalesce streamed chunks into ~30 renders/s
+_EAGER_HISTORY = 12        # newest history messages built up front in set_card
+_LAZY_MARGIN_PX = 500      # build placeholders this close to the viewport
+_HISTORY_CACHE_CARDS = 256 # cards kept in _history_store when backed by the DB
+_OFFLOAD_CHARS = 2048      # stream tails longer than this render off the GUI thread
+
+_MD_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ankihack-md")
+
+# Ctrl/Cmd+key combos ChatInput claims for text editing
+_EDITING_KEYS = frozenset({
+    Qt.Key.Key_A, Qt.Key.Key_C, Qt.Key.Key_V, Qt.Key.Key_X,
+    Qt.Key.Key_Z, Qt.Key.Key_Y,
+    Qt.Key.Key_Left, Qt.Key.Key_Right,
+    Qt.Key.Key_Up, Qt.Key.Key_Down,
+    Qt.Key.Key_Return, Qt.Key.Key_Enter,
+    Qt.Key.Key_Backspace, Qt.Key.Key_Delete,
+})
+
+_RE_NL3 = re.compile(r'\n{3,}')
+_RE_TOOL = re.compile(
+    r'\s*<(create_card|create_cloze|search_cards|change_deck|update_card_back)>(.*?)</\1>',
+    re.DOTALL,
+)
 
 
 class ChatInput(QPlainTextEdit):
@@ -36,7 +62,6 @@ class ChatInput(QPlainTextEdit):
         self.document().contentsChanged.connect(
             lambda: QTimer.singleShot(0, self._adjust_height)
         )
-        from aqt.qt import QPalette
         window_color = mw.palette().color(QPalette.ColorRole.Window)
         is_dark = window_color.lightness() < 128
         # Slightly darker than the window background
@@ -57,10 +82,11 @@ class ChatInput(QPlainTextEdit):
 
     def _adjust_height(self):
         # Sum visual line counts across all blocks — blockCount() alone misses
-        # wrapping within a single paragraph.
+        # wrapping within a single paragraph. Stop once the cap is reached so
+        # long inputs don't rescan every block per keystroke.
         visual_lines = 0
         block = self.document().begin()
-        while block.isValid():
+        while block.isValid() and visual_lines < self._MAX_LINES:
             layout = block.layout()
             visual_lines += layout.lineCount() if (layout and layout.lineCount() > 0) else 1
             block = block.next()
@@ -91,16 +117,8 @@ class ChatInput(QPlainTextEdit):
         # All other Cmd/Ctrl+key combos (e.g. Cmd+Q, Cmd+W) must pass
         # through so the OS/app-level shortcuts can fire.
         if event.type() == QEvent.Type.ShortcutOverride:
-            _editing = {
-                Qt.Key.Key_A, Qt.Key.Key_C, Qt.Key.Key_V, Qt.Key.Key_X,
-                Qt.Key.Key_Z, Qt.Key.Key_Y,
-                Qt.Key.Key_Left, Qt.Key.Key_Right,
-                Qt.Key.Key_Up, Qt.Key.Key_Down,
-                Qt.Key.Key_Return, Qt.Key.Key_Enter,
-                Qt.Key.Key_Backspace, Qt.Key.Key_Delete,
-            }
             if (event.modifiers() & Qt.KeyboardModifier.ControlModifier
-                    and event.key() not in _editing):
+                    and event.key() not in _EDITING_KEYS):
                 event.ignore()
                 return True
         return super().event(event)
@@ -163,22 +181,26 @@ class ChatTab(QWidget):
         )
         self._scroll.viewport().setStyleSheet("background: transparent;")
 
-        self._inner = QWidget()
-        self._inner.setStyleSheet("background: transparent;")
-        from aqt.qt import QVBoxLayout as _VBox
-        self._bubbles = _VBox(self._inner)
-        self._bubbles.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self._bubbles.setSpacing(6)
-        self._bubbles.setContentsMargins(4, 4, 4, 4)
-        self._scroll.setWidget(self._inner)
+        self._build_inner()
         layout.addWidget(self._scroll)
         sb = self._scroll.verticalScrollBar()
         sb.rangeChanged.connect(self._on_range_changed)
         sb.valueChanged.connect(self._on_scroll_moved)
         self._stick_to_bottom = True
+        # Many _scroll_to_bottom() calls per event-loop turn -> one setValue
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(0)
+        self._scroll_timer.timeout.connect(self._do_scroll_bottom)
+        self._placeholders = 0           # BubblePlaceholders still in the layout
+        self._keep_from_bottom = None    # scroll anchor while placeholders grow
 
         # Overlay — shown during question phase, hidden when answer is revealed
         self._overlay = BlurOverlay(self)
+        self._blur = QGraphicsBlurEffect(self)
+        self._blur.setBlurRadius(32)
+        self._blur.setEnabled(False)
+        self._scroll.setGraphicsEffect(self._blur)
 
         # Difficulty hint — shown when FSRS flags the card as hard
         self._difficulty_label = QLabel()
@@ -217,11 +239,16 @@ class ChatTab(QWidget):
 
         # Per-card message history: {card_id: [(is_user, raw_text), ...]}
         self._history_store: dict[int, list[tuple[bool, str]]] = {}
-        self._messages: list[tuple[bool, str]] = []
+        self._messages: list[tuple[bool, str]] = []   # aliases _history_store[current card]
         self._current_card_id: Optional[int] = None
         self._current_ai_bubble: Optional[AiBubble] = None
         self._ai_raw: str = ""
         self._ai_msg_idx: int = 0
+        self._ai_frozen_len: int = 0   # prefix of _ai_raw already appended to the bubble
+        self._render_pending = False
+        self._last_render_len = 0
+        self._render_seq = 0         # bumped per tail render; drops stale worker results
+        self._tail_future = None
 
         self._next_update_card = False   # set True when "Svara" triggers the next message
         self._cancel_event = None        # threading.Event set when streaming is active
@@ -243,7 +270,7 @@ class ChatTab(QWidget):
             return f"{n/1024:.1f} KB" if n >= 1024 else f"{n} B"
         parts = [f"text {_fmt(text_bytes)}"]
         if images:
-            img_bytes = sum(len(img["data"]) * 3 // 4 for img in images)
+            img_bytes = sum(img["decoded_bytes"] for img in images)
             parts.append(f"{len(images)} bild{'er' if len(images) != 1 else ''} {_fmt(img_bytes)}")
         self.prompt_size_label.setText("Prompt: " + " + ".join(parts))
 
@@ -282,36 +309,107 @@ class ChatTab(QWidget):
             self._quick_btn_layout.addWidget(btn)
 
     def set_card(self, card_id: int):
-        if self._current_card_id is not None:
-            self._history_store[self._current_card_id] = list(self._messages)
+        if self._db is not None:
+            self._db.flush()
 
         self._current_card_id = card_id
         self._clear_bubbles()
 
-        # Load from DB if not already in memory cache
-        if card_id not in self._history_store and self._db is not None:
-            self._history_store[card_id] = self._db.load(card_id)
-
-        for is_user, raw in self._history_store.get(card_id, []):
-            if is_user:
-                self._bubbles.addWidget(UserBubble(raw))
+        # _messages *is* the stored list for the current card, so appends land
+        # in the cache directly. Load from DB if not already in memory.
+        history = self._history_store.pop(card_id, None)
+        if history is None:
+            history = self._db.load(card_id) if self._db is not None else []
+        self._history_store[card_id] = history   # (re)insert as most recent
+        self._messages = history
+        self._evict_history()
+
+        # Only the newest messages are visible after scrolling to the bottom;
+        # older ones stay placeholders until they scroll into view.
+        eager_from = len(history) - _EAGER_HISTORY
+        for i, (is_user, raw) in enumerate(history):
+            if i < eager_from:
+                self._bubbles.addWidget(BubblePlaceholder(is_user, raw))
+                self._placeholders += 1
             else:
-                b = AiBubble()
-                b.set_html(md_to_html(raw), raw)
-                self._bubbles.addWidget(b)
+                self._bubbles.addWidget(self._make_bubble(is_user, raw))
 
-        self._messages = list(self._history_store.get(card_id, []))
         self._scroll_to_bottom()
+        if self._placeholders:
+            # Short eager bubbles may leave placeholders on screen.
+            QTimer.singleShot(0, self._materialize_visible)
+
+    def _evict_history(self):
+        """Drop the least recently shown cards' cached history.
+
+        Only with a DB: evicted cards reload from it, so memory stays bounded
+        over long review sessions without losing anything.
+        """
+        if self._db is None:
+            return
+        store = self._history_store
+        while len(store) > _HISTORY_CACHE_CARDS:
+            oldest = next(iter(store))
+            if oldest == self._current_card_id:
+                break
+            del store[oldest]
+
+    def preload_history(self, nids: list[int]):
+        """Warm _history_store for upcoming cards with a single DB query."""
+        if self._db is None:
+            return
+        missing = [nid for nid in nids if nid not in self._history_store]
+        if missing:
+            self._history_store.update(self._db.load_many(missing))
+            self._evict_history()
+
+    def flush_history(self):
+        """Write any buffered chat rows to the DB."""
+        if self._db is not None:
+            self._db.flush()
+
+    @staticmethod
+    def _make_bubble(is_user: bool, raw: str) -> QWidget:
+        if is_user:
+            return UserBubble(raw)
+        b = AiBubble()
+        b.set_html(md_to_html(raw), raw)
+        return b
+
+    def _materialize_visible(self):
+        """Replace placeholders near the viewport with real bubbles."""
+        sb = self._scroll.verticalScrollBar()
+        top = sb.value() - _LAZY_MARGIN_PX
+        bottom = sb.value() + self._scroll.viewport().height() + _LAZY_MARGIN_PX
+        hits = []
+        for i in range(self._bubbles.count()):
+            w = self._bubbles.itemAt(i).widget()
+            if isinstance(w, BubblePlaceholder):
+                g = w.geometry()
+                if g.bottom() >= top and g.top() <= bottom:
+                    hits.append((i, w))
+        if not hits:
+            return
+        # Real bubbles are taller than placeholders; hold the distance from
+        # the bottom so the content under the viewport doesn't jump.
+        self._keep_from_bottom = sb.maximum() - sb.value()
+        for i, ph in hits:
+            self._bubbles.removeWidget(ph)
+            self._bubbles.insertWidget(i, self._make_bubble(ph.is_user, ph.raw))
+            ph.deleteLater()
+        self._placeholders -= len(hits)
 
     def add_user_message(self, text: str):
         self._messages.append((True, text))
         if self._db is not None and self._current_card_id is not None:
-            self._db.append(self._current_card_id, len(self._messages) - 1, True, text)
+            self._db.append_new(self._current_card_id, len(self._messages) - 1, True, text)
         self._bubbles.addWidget(UserBubble(text))
         self._scroll_to_bottom()
 
     def add_ai_message_start(self):
         self._ai_raw = ""
+        self._ai_frozen_len = 0
+        self._last_render_len = 0
         self._ai_msg_idx = len(self._messages)
         self._messages.append((False, ""))
         self._current_ai_bubble = AiBubble()
@@ -320,63 +418,112 @@ class ChatTab(QWidget):
 
     def append_ai_chunk(self, chunk: str):
         self._ai_raw += chunk
-        if self._current_ai_bubble:
-            self._current_ai_bubble.set_html(md_to_html(self._ai_raw), self._ai_raw)
-            self._scroll_to_bottom()
+        if self._current_ai_bubble and not self._render_pending:
+            self._render_pending = True
+            QTimer.singleShot(_RENDER_INTERVAL_MS, self._render_ai)
+
+    def _render_ai(self):
+        """Render the streaming buffer once per timer tick, not per chunk."""
+        self._render_pending = False
+        bubble = self._current_ai_bubble
+        if not bubble:
+            return
+        raw = self._ai_raw
+        if len(raw) == self._last_render_len:
+            return
+        if self._tail_future is not None and not self._tail_future.done():
+            # Previous offloaded render still running; try again next tick.
+            self._render_pending = True
+            QTimer.singleShot(_RENDER_INTERVAL_MS, self._render_ai)
+            return
+        self._last_render_len = len(raw)
+        # Paragraphs before the last blank line are final; append them once
+        # unless the cut would land inside an open code fence.
+        cut = raw.rfind("\n\n")
+        if cut > self._ai_frozen_len and raw.count("```", 0, cut) % 2 == 0:
+            bubble.append_html(md_to_fragment_html(raw[self._ai_frozen_len:cut]))
+            self._ai_frozen_len = cut + 2
+        tail = raw[self._ai_frozen_len:]
+        if raw.count("```") % 2:
+            # Close a half-streamed fence so it renders as code, not as
+            # flickering inline markup, until the real closing fence arrives.
+            tail += "\n```"
+        self._render_seq += 1
+        if len(tail) > _OFFLOAD_CHARS:
+            seq = self._render_seq
+            fut = self._tail_future = _MD_EXEC.submit(md_to_fragment_html, tail)
+            fut.add_done_callback(
+                lambda f: mw.taskman.run_on_main(lambda: self._apply_tail(seq, bubble, f, raw))
+            )
+            return
+        bubble.set_tail_html(md_to_fragment_html(tail), raw)
+        self._scroll_to_bottom()
+
+    def _apply_tail(self, seq: int, bubble, fut, raw: str):
+        """Install an offloaded tail render unless a newer one superseded it."""
+        if seq != self._render_seq or bubble is not self._current_ai_bubble:
+            return
+        try:
+            html = fut.result()
+        except Exception:
+            return
+        bubble.set_tail_html(html, raw)
+        self._scroll_to_bottom()
 
     @staticmethod
     def _clean(raw: str) -> str:
         """Collapse 3+ consecutive newlines to 2, strip trailing whitespace."""
-        return re.sub(r'\n{3,}', '\n\n', raw).strip()
+        return _RE_NL3.sub('\n\n', raw).strip()
+
+    def _dispatch_tool(self, tag: str, body: str):
+        """Invoke the callback for one <tag>body</tag> emitted by the AI."""
+        if tag in ("create_card", "create_cloze"):
+            try:
+                data = json.loads(body)
+                if tag == "create_card":
+                    if self.on_create_card:
+                        self.on_create_card(data.get("front", ""), data.get("back", ""))
+                elif self.on_create_cloze:
+                    self.on_create_cloze(data.get("text", ""), data.get("extra", ""))
+            except (ValueError, KeyError):
+                pass
+            return
+        body = body.strip()
+        if not body:
+            return
+        if tag == "search_cards":
+            if self.on_search_cards:
+                self.on_search_cards(body)
+        elif tag == "change_deck":
+            if self.on_change_deck:
+                self.on_change_deck(body)
+        elif tag == "update_card_back":
+            if self.on_update_card_back:
+                self.on_update_card_back(body)
 
     def end_ai_message(self):
         if self._current_ai_bubble:
             cleaned = self._clean(self._ai_raw)
 
-            import json as _json
-
-            for match in re.findall(r'<create_card>(.*?)</create_card>', cleaned, re.DOTALL):
-                try:
-                    data = _json.loads(match)
-                    if self.on_create_card:
-                        self.on_create_card(data.get("front", ""), data.get("back", ""))
-                except (ValueError, KeyError):
-                    pass
-
-            for match in re.findall(r'<search_cards>(.*?)</search_cards>', cleaned, re.DOTALL):
-                query = match.strip()
-                if query and self.on_search_cards:
-                    self.on_search_cards(query)
-
-            for match in re.findall(r'<change_deck>(.*?)</change_deck>', cleaned, re.DOTALL):
-                deck_name = match.strip()
-                if deck_name and self.on_change_deck:
-                    self.on_change_deck(deck_name)
-
-            for match in re.findall(r'<update_card_back>(.*?)</update_card_back>', cleaned, re.DOTALL):
-                content = match.strip()
-                if content and self.on_update_card_back:
-                    self.on_update_card_back(content)
-
-            for match in re.findall(r'<create_cloze>(.*?)</create_cloze>', cleaned, re.DOTALL):
-                try:
-                    data = _json.loads(match)
-                    if self.on_create_cloze:
-                        self.on_create_cloze(data.get("text", ""), data.get("extra", ""))
-                except (ValueError, KeyError):
-                    pass
-
-            cleaned = re.sub(
-                r'\s*<(create_card|create_cloze|search_cards|change_deck|update_card_back)>.*?'
-                r'</\1>',
-                '', cleaned, flags=re.DOTALL,
-            ).strip()
+            # One pass: dispatch each tool tag and keep the text between them.
+            # Most replies have no tags at all, so skip the scan without a '<'.
+            if "<" in cleaned:
+                parts = []
+                pos = 0
+                for m in _RE_TOOL.finditer(cleaned):
+                    parts.append(cleaned[pos:m.start()])
+                    pos = m.end()
+                    self._dispatch_tool(m.group(1), m.group(2))
+                if parts:
+                    parts.append(cleaned[pos:])
+                    cleaned = "".join(parts).strip()
 
             self._ai_raw = cleaned
             self._current_ai_bubble.set_html(md_to_html(cleaned), cleaned)
             self._messages[self._ai_msg_idx] = (False, cleaned)
             if self._db is not None and self._current_card_id is not None:
-                self._db.append(self._current_card_id, self._ai_msg_idx, False, cleaned)
+                self._db.replace(self._current_card_id, self._ai_msg_idx, False, cleaned)
+                self._db.flush()
             if self._next_update_card and self.on_update_card:
                 self._current_ai_bubble.show_update_button(self.on_update_card)
             self._next_update_card = False
@@ -399,7 +546,7 @@ class ChatTab(QWidget):
         b.set_html(md_to_html(text), text)
         self._messages.append((False, text))
         if self._db is not None and self._current_card_id is not None:
-            self._db.append(self._current_card_id, len(self._messages) - 1, False, text)
+            self._db.append_new(self._current_card_id, len(self._messages) - 1, False, text)
         self._bubbles.addWidget(b)
         self._scroll_to_bottom()
 
@@ -409,24 +556,47 @@ class ChatTab(QWidget):
 
     def _scroll_to_bottom(self):
         self._stick_to_bottom = True
+        self._scroll_timer.start()
+
+    def _do_scroll_bottom(self):
         sb = self._scroll.verticalScrollBar()
         sb.setValue(sb.maximum())
 
     def _on_range_changed(self, _min, _max):
         """Fires after layout reflows — scroll to new bottom if pinned."""
         if self._stick_to_bottom:
-            self._scroll.verticalScrollBar().setValue(_max)
+            sb = self._scroll.verticalScrollBar()
+            if sb.value() != _max:
+                sb.setValue(_max)
+        elif self._keep_from_bottom is not None:
+            keep, self._keep_from_bottom = self._keep_from_bottom, None
+            self._scroll.verticalScrollBar().setValue(_max - keep)
 
     def _on_scroll_moved(self, value):
         """Un-pin if user scrolled up; re-pin if they scroll back to the bottom."""
         sb = self._scroll.verticalScrollBar()
         self._stick_to_bottom = (value >= sb.maximum() - 4)
+        if self._placeholders:
+            self._materialize_visible()
+
+    def _build_inner(self):
+        """Create the bubble container and install it in the scroll area."""
+        self._inner = QWidget()
+        self._inner.setStyleSheet("background: transparent;")
+        self._bubbles = QVBoxLayout(self._inner)
+        self._bubbles.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self._bubbles.setSpacing(6)
+        self._bubbles.setContentsMargins(4, 4, 4, 4)
+        self._scroll.setWidget(self._inner)
 
     def _clear_bubbles(self):
-        while self._bubbles.count():
-            item = self._bubbles.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
+        # Swap in a fresh container; Qt tears down all old bubbles with it.
+        old = self._scroll.takeWidget()
+        if old is not None:
+            old.deleteLater()
+        self._build_inner()
+        self._placeholders = 0
+        self._keep_from_bottom = None
         self._messages = []
         self._current_ai_bubble = None
         self._ai_raw = ""
@@ -449,8 +619,9 @@ class ChatTab(QWidget):
 
     def _on_new_conversation(self):
         self._clear_bubbles()
+        clear_md_cache()
         if self._current_card_id is not None:
-            self._history_store.pop(self._current_card_id, None)
+            self._history_store[self._current_card_id] = self._messages
             if self._db is not None:
                 self._db.delete(self._current_card_id)
 
@@ -466,15 +637,13 @@ class ChatTab(QWidget):
         self._overlay.setGeometry(self._scroll.geometry())
 
     def show_blur(self):
-        effect = QGraphicsBlurEffect()
-        effect.setBlurRadius(32)
-        self._scroll.setGraphicsEffect(effect)
+        self._blur.setEnabled(True)
         self._reposition_overlay()
         self._overlay.show()
         self._overlay.raise_()
 
     def hide_blur(self):
-        self._scroll.setGraphicsEffect(None)
+        self._blur.setEnabled(False)
         self._overlay.hide()
 
     # ------------------------------------------------------------------
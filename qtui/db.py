@@ -1,41 +1,108 @@
 """SQLite-backed persistence for per-card chat history."""
 from __future__ import annotations
+import sqlite3
+
+_INSERT_SQL = "INSERT INTO chat_messages (nid, seq, is_user, text) VALUES (?,?,?,?)"
+_REPLACE_SQL = "INSERT OR REPLACE INTO chat_messages (nid, seq, is_user, text) VALUES (?,?,?,?)"
+_SELECT_SQL = "SELECT is_user, text FROM chat_messages WHERE nid=? ORDER BY seq"
+_FLUSH_AT = 32
+# WITHOUT ROWID clusters rows by (nid, seq), so load() is one range scan.
+_CREATE_SQL = """
+    CREATE TABLE {name} (
+        nid     INTEGER NOT NULL,
+        seq     INTEGER NOT NULL,
+        is_user INTEGER NOT NULL,
+        text    TEXT NOT NULL,
+        PRIMARY KEY (nid, seq)
+    ) WITHOUT ROWID
+"""
 
 
 class ChatDB:
-    """SQLite wrapper; table chat_messages(nid, seq, is_user, text)."""
+    """SQLite wrapper; table chat_messages(nid, seq, is_user, text).
+
+    Writes are buffered and written in one transaction by flush(), so a
+    chat turn costs one commit instead of one per message. New rows use a
+    plain INSERT; only replace() pays for SQLite's delete-then-insert path.
+    """
 
     def __init__(self, path: str):
-        import sqlite3
         self._conn = sqlite3.connect(path, check_same_thread=False)
-        self._conn.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                nid     INTEGER NOT NULL,
-                seq     INTEGER NOT NULL,
-                is_user INTEGER NOT NULL,
-                text    TEXT NOT NULL,
-                PRIMARY KEY (nid, seq)
-            )
-        """)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-20000")
+        row = self._conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='chat_messages'"
+        ).fetchone()
+        if row is None:
+            self._conn.execute(_CREATE_SQL.format(name="chat_messages"))
+        elif "WITHOUT ROWID" not in row[0].upper():
+            self._migrate_without_rowid()
         self._conn.commit()
+        self._pending: list[tuple] = []
+        self._pending_replace: list[tuple] = []
+
+    def _migrate_without_rowid(self):
+        """Rebuild a rowid chat_messages table from older versions in place."""
+        self._conn.execute("BEGIN")
+        with self._conn:
+            self._conn.execute(_CREATE_SQL.format(name="chat_messages_new"))
+            self._conn.execute(
+                "INSERT INTO chat_messages_new (nid, seq, is_user, text) "
+                "SELECT nid, seq, is_user, text FROM chat_messages"
+            )
+            self._conn.execute("DROP TABLE chat_messages")
+            self._conn.execute("ALTER TABLE chat_messages_new RENAME TO chat_messages")
 
     def load(self, nid: int) -> list:
-        rows = self._conn.execute(
-            "SELECT is_user, text FROM chat_messages WHERE nid=? ORDER BY seq",
-            (nid,),
-        ).fetchall()
-        return [(bool(r[0]), r[1]) for r in rows]
-
-    def append(self, nid: int, seq: int, is_user: bool, text: str):
-        self._conn.execute(
-            "INSERT OR REPLACE INTO chat_messages (nid, seq, is_user, text) VALUES (?,?,?,?)",
-            (nid, seq, int(is_user), text),
+        self.flush()
+        return [(bool(u), t) for u, t in self._conn.execute(_SELECT_SQL, (nid,))]
+
+    def load_many(self, nids: list[int]) -> dict[int, list]:
+        """Batch load(): one query for several notes, [] for notes without rows."""
+        self.flush()
+        result: dict[int, list] = {nid: [] for nid in nids}
+        if not nids:
+            return result
+        sql = (
+            "SELECT nid, is_user, text FROM chat_messages "
+            f"WHERE nid IN ({','.join('?' * len(nids))}) ORDER BY nid, seq"
         )
-        self._conn.commit()
+        for nid, u, t in self._conn.execute(sql, nids):
+            result[nid].append((bool(u), t))
+        return result
+
+    def append_new(self, nid: int, seq: int, is_user: bool, text: str):
+        self._pending.append((nid, seq, int(is_user), text))
+        if len(self._pending) >= _FLUSH_AT:
+            self.flush()
+
+    def replace(self, nid: int, seq: int, is_user: bool, text: str):
+        self._pending_replace.append((nid, seq, int(is_user), text))
+        if len(self._pending_replace) >= _FLUSH_AT:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in a single transaction."""
+        if not (self._pending or self._pending_replace):
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(_INSERT_SQL, self._pending)
+                self._conn.executemany(_REPLACE_SQL, self._pending_replace)
+        except sqlite3.IntegrityError:
+            # A seq collided with a stored row; overwrite like before.
+            with self._conn:
+                self._conn.executemany(_REPLACE_SQL, self._pending + self._pending_replace)
+        self._pending.clear()
+        self._pending_replace.clear()
 
     def delete(self, nid: int):
+        self.flush()
         self._conn.execute("DELETE FROM chat_messages WHERE nid=?", (nid,))
         self._conn.commit()
 
     def close(self):
+        self.flush()
         self._conn.close()
@@ -2,32 +2,64 @@
 from __future__ import annotations
 import html as html_module
 import re
+import threading
+from functools import lru_cache
+
+_RE_PARA_BOUNDARY = re.compile(r'</p>\s*<p>')
+_RE_BARE_P = re.compile(r'</?p>')
+
+# Installed once as each chat bubble document's default stylesheet.
+CHAT_CSS = (
+    "h1 { font-size: 1.15em; margin: 4px 0; }"
+    "h2 { font-size: 1.05em; margin: 4px 0; }"
+    "h3, h4, h5, h6 { font-size: 1em; margin: 3px 0; }"
+)
+
+# Characters that can start any markdown or raw-HTML construct. Short text
+# without them renders to a single plain paragraph.
+_MD_META = frozenset('*_`#[]!<>&\\|~-+=\n')
+
+
+def _is_plain(text: str) -> bool:
+    return (
+        len(text) < 128
+        and text == text.strip()
+        and not text[:1].isdigit()
+        and _MD_META.isdisjoint(text)
+    )
+
 
 try:
     import markdown as _markdown_lib
-    _md_renderer = _markdown_lib.Markdown(extensions=["extra"])
-
-    _CHAT_CSS = (
-        "<style>"
-        "h1 { font-size: 1.15em; margin: 4px 0; }"
-        "h2 { font-size: 1.05em; margin: 4px 0; }"
-        "h3, h4, h5, h6 { font-size: 1em; margin: 3px 0; }"
-        "</style>"
-    )
 
-    def md_to_html(text: str) -> str:
-        _md_renderer.reset()
-        return _CHAT_CSS + _md_renderer.convert(text)
+    # Markdown instances carry parse state; keep one per thread so the chat
+    # stream can render off the GUI thread.
+    _md_local = threading.local()
+
+    def _md_renderer():
+        md = getattr(_md_local, "md", None)
+        if md is None:
+            md = _md_local.md = _markdown_lib.Markdown(extensions=["extra"])
+        md.reset()
+        return md
+
+    def md_to_fragment_html(text: str) -> str:
+        """Uncached md_to_html, for streamed fragments that never repeat."""
+        if _is_plain(text):
+            return f"<p>{text}</p>" if text else ""
+        return _md_renderer().convert(text)
+
+    md_to_html = lru_cache(maxsize=512)(md_to_fragment_html)
 
     def md_to_card_html(text: str) -> str:
         """Compact HTML for storing in an Anki card field."""
-        _md_renderer.reset()
-        html = _md_renderer.convert(text)
-        html = re.sub(r'</p>\s*<p>', '<br>', html)
-        html = re.sub(r'</?p>', '', html)
+        html = _md_renderer().convert(text)
+        html = _RE_PARA_BOUNDARY.sub('<br>', html)
+        html = _RE_BARE_P.sub('', html)
         return html.strip()
 
 except ImportError:
+    @lru_cache(maxsize=512)
     def md_to_html(text: str) -> str:
         """Fallback: minimal regex markdown."""
         t = html_module.escape(text)
@@ -37,5 +69,12 @@ except ImportError:
         t = t.replace('\n', '<br>')
         return t
 
+    md_to_fragment_html = md_to_html.__wrapped__
+
     def md_to_card_html(text: str) -> str:
         return md_to_html(text)
+
+
+def clear_md_cache():
+    """Drop memoized md_to_html renders."""
+    md_to_html.cache_clear()
@@ -1,15 +1,27 @@
 """ReviewPanel — the main QDockWidget that hosts Chat and Resources tabs."""
 from __future__ import annotations
+import base64
+import os
 import re
+import stat
+import threading
 
 from aqt import mw
-from aqt.qt import QDockWidget, QWidget, QVBoxLayout, QTabWidget, Qt
+from aqt.qt import (
+    QDockWidget, QWidget, QVBoxLayout, QTabWidget, Qt, QTimer, QApplication,
+)
 
+from .. import direct_ai
+from ..difficulty import is_difficult, difficulty_label
+from ..tools import SYSTEM_PROMPT, ToolHandler
 from .chat_tab import ChatTab
 from .db import ChatDB
 from .markdown import md_to_card_html
 from .resources_tab import ResourcesTab
 
+_TAG_STRIP = re.compile(r'<[^>]+>')
+_IMG_SRC = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.I)
+
 
 class ReviewPanel(QDockWidget):
     def __init__(self):
@@ -40,7 +52,6 @@ class ReviewPanel(QDockWidget):
         self.chat_tab.on_update_card = self._on_update_card
         self.chat_tab.on_model_change = self._on_model_change
 
-        from ..tools import ToolHandler
         self._tool_handler = ToolHandler(
             mw=mw,
             get_current_card=lambda: self._current_card,
@@ -53,9 +64,9 @@ class ReviewPanel(QDockWidget):
         self.chat_tab.on_update_card_back = self._tool_handler.update_card_back
         self.chat_tab.on_create_cloze = self._tool_handler.create_cloze
         self._image_sent_sessions: set = set()
+        self._card_images_cache: dict[tuple, list] = {}
 
         # Open persistent chat DB alongside the Anki collection
-        import os
         try:
             db_path = os.path.join(os.path.dirname(mw.col.path), "ankihack_chat.db")
         except Exception:
@@ -71,6 +82,7 @@ class ReviewPanel(QDockWidget):
         self.chat_tab.set_harness(cfg.get("harness", "?"))
         self.chat_tab.set_model(cfg.get("claude_acp_model", "claude-haiku-4-5-20251001"))
         self.chat_tab.set_quick_buttons(cfg.get("quick_buttons", []))
+        self._attach_images = bool(cfg.get("attach_card_images", True))
 
     @staticmethod
     def _cfg():
@@ -83,26 +95,42 @@ class ReviewPanel(QDockWidget):
     @staticmethod
     def _extract_card_images(card, max_images: int = 4) -> list:
         """Return base64 image dicts for all images in the card's fields."""
-        import base64, os
         if not card:
             return []
         media_dir = mw.col.media.dir()
         ext_map = {".jpg": "image/jpeg", ".jpeg": "image/jpeg",
                    ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
         results = []
-        for field in card.note().fields:
-            for src in re.findall(r'<img[^>]+src=["\']([^"\']+)["\']', field, re.I):
-                path = os.path.join(media_dir, src)
-                if not os.path.isfile(path):
-                    continue
-                media_type = ext_map.get(os.path.splitext(src)[1].lower(), "image/jpeg")
-                with open(path, "rb") as f:
-                    results.append({"media_type": media_type,
-                                    "data": base64.b64encode(f.read()).decode()})
-                if len(results) >= max_images:
-                    return results
+        for m in _IMG_SRC.finditer("\n".join(card.note().fields)):
+            src = m.group(1)
+            path = os.path.join(media_dir, src)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            media_type = ext_map.get(os.path.splitext(src)[1].lower(), "image/jpeg")
+            with open(path, "rb") as f:
+                data = base64.b64encode(f.read()).decode()
+            results.append({"media_type": media_type,
+                            "data": data,
+                            "decoded_bytes": st.st_size})
+            if len(results) >= max_images:
+                break
         return results
 
+    def _card_images(self, card) -> list:
+        """_extract_card_images, cached for the current card until the note
+        is edited. Only one entry is kept so base64 payloads don't pile up
+        over a long review session."""
+        key = (card.id, card.note().mod)
+        images = self._card_images_cache.get(key)
+        if images is None:
+            images = self._extract_card_images(card)
+            self._card_images_cache = {key: images}
+        return images
+
     @staticmethod
     def _note_supports_update(note) -> bool:
         model = note.note_type()
@@ -113,6 +141,15 @@ class ReviewPanel(QDockWidget):
             return False
         return True
 
+    @staticmethod
+    def _upcoming_nids(limit: int = 10) -> list:
+        """Note ids of the next cards in the review queue (v3 scheduler)."""
+        try:
+            queued = mw.col.sched.get_queued_cards(fetch_limit=limit)
+            return [c.card.note_id for c in queued.cards]
+        except Exception:
+            return []
+
     def on_new_card(self, card):
         self._current_card = card
         front = card.note().fields[0] if card.note().fields else ""
@@ -122,8 +159,8 @@ class ReviewPanel(QDockWidget):
         self.chat_tab.set_card(card.nid)
         if self.chat_tab._messages:
             self.chat_tab.show_blur()
+        QTimer.singleShot(0, lambda: self.chat_tab.preload_history(self._upcoming_nids()))
 
-        from ..difficulty import is_difficult, difficulty_label
         if is_difficult(card, self._cfg()):
             self.chat_tab.show_difficulty_hint(difficulty_label(card))
         else:
@@ -132,11 +169,10 @@ class ReviewPanel(QDockWidget):
         note = card.note()
         card_text = "\n".join(note.fields)
         text_bytes = len(card_text.encode("utf-8"))
-        images = self._extract_card_images(card)
+        images = self._card_images(card) if self._attach_images else []
         self.chat_tab.set_prompt_size(text_bytes, images)
 
-        import re as _re
-        plain_front = _re.sub(r'<[^>]+>', '', front)
+        plain_front = _TAG_STRIP.sub('', front)
         plain_front = plain_front.replace('&nbsp;', ' ').replace('&amp;', '&') \
                                  .replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
         plain_front = plain_front.strip()[:120]
@@ -144,7 +180,6 @@ class ReviewPanel(QDockWidget):
 
     def keyPressEvent(self, event):
         """Forward unhandled key presses to Anki's main window."""
-        from aqt.qt import QApplication
         QApplication.sendEvent(mw, event)
 
     def on_answer_shown(self):
@@ -152,6 +187,8 @@ class ReviewPanel(QDockWidget):
 
     def on_review_ended(self):
         self._current_card = None
+        self._card_images_cache.clear()
+        self.chat_tab.flush_history()
         self.chat_tab.hide_blur()
 
     # ------------------------------------------------------------------
@@ -163,7 +200,6 @@ class ReviewPanel(QDockWidget):
         cfg = self._cfg()
         cfg["claude_acp_model"] = model_id
         mw.addonManager.writeConfig(__name__, cfg)
-        from .. import direct_ai
         direct_ai._acp_clients.clear()
 
     def _on_chat_send(self, text: str):
@@ -176,19 +212,18 @@ class ReviewPanel(QDockWidget):
 
         session_key = f"chat:{nid}" if nid else None
         is_first = session_key not in self._image_sent_sessions
-        images = self._extract_card_images(card) if (card and is_first) else []
+        images = (
+            self._card_images(card) if (card and is_first and self._attach_images) else []
+        )
         if images and session_key:
             self._image_sent_sessions.add(session_key)
 
         self.chat_tab.add_user_message(text)
         self.chat_tab.add_ai_message_start()
 
-        import threading
         cancel_event = threading.Event()
         self.chat_tab.start_streaming(cancel_event)
 
-        from ..direct_ai import ask_ai_async
-        from ..tools import SYSTEM_PROMPT
         cfg = self._cfg()
 
         def on_chunk(chunk: str):
@@ -201,7 +236,7 @@ class ReviewPanel(QDockWidget):
             mw.taskman.run_on_main(lambda: self.chat_tab.append_ai_chunk(f"[Fel: {err}]"))
             mw.taskman.run_on_main(self.chat_tab.end_ai_message)
 
-        ask_ai_async(
+        direct_ai.ask_ai_async(
             system_prompt=SYSTEM_PROMPT,
             card_context=card_context,
             user_question=text,
@@ -215,29 +250,4 @@ class ReviewPanel(QDockWidget):
         )
 
     def _on_update_card(self, raw_markdown: str):
-        card = self._current_card
-        if not card:
-            return
-        note = card.note()
-        model = note.note_type()
-        field_names = [f["name"] for f in model["flds"]]
-        is_cloze = model.get("type", 0) == 1
-
-        if is_cloze:
-            idx = next(
-                (i for i, n in enumerate(field_names)
-                 if any(kw in n.lower() for kw in ("extra", "back"))),
-                len(field_names) - 1 if len(field_names) > 1 else None,
-            )
-        else:
-            idx = next(
-                (i for i, n in enumerate(field_names)
-                 if any(kw in n.lower() for kw in ("back", "answer", "svar", "baksida"))),
-                1 if len(field_names) > 1 else None,
-            )
-
-        if idx is None:
-            return
-
-        note.fields[idx] = md_to_card_html(raw_markdown)
-        mw.col.update_note(note)
+        self._tool_handler.update_card_back(raw_markdown)
@@ -1,14 +1,86 @@
 """Resources tab widget — lecture slides, images, videos, links."""
 from __future__ import annotations
 import html as html_module
+import logging
 import re
+from functools import lru_cache
 
 from aqt import mw
 from aqt.qt import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-    QPushButton, QTextBrowser, Qt,
+    QPushButton, QTextBrowser, Qt, QTimer, QUrl, QDesktopServices,
 )
 
+# Result buckets usually land within ~100 ms of each other; one render
+# after the burst replaces up to four back-to-back setHtml calls.
+_RENDER_DEBOUNCE_MS = 100
+
+log = logging.getLogger("ankihack.resources")
+
+_MD_STRIP = re.compile(r'[#*_`]')
+
+
+@lru_cache(maxsize=256)
+def _slide_html(s) -> str:
+    """HTML block for one lecture_search.Slide; Slides are immutable, so cache it."""
+    block = html_module.escape((s.block or "").replace("_", " "))
+    lecture = html_module.escape((s.lecture or "").replace("_", " "))
+    slide_num = s.slide_num if s.slide_num is not None else "?"
+    png = s.png_path or ""
+    matched = html_module.escape(", ".join(s.matched_by))
+    rrf = s.rrf_score
+    rrf_str = f"{rrf:.3f}" if rrf else ""
+
+    ai = _MD_STRIP.sub('', s.ai_txt or s.slide_txt or "")
+    ai = ai.replace("\n", " ").strip()[:200]
+    ai_esc = html_module.escape(ai)
+
+    file_url = f"file://{png}" if png else ""
+    img_tag = (
+        f'<a href="{html_module.escape(file_url)}">'
+        f'<img src="{html_module.escape(file_url)}" width="200" '
+        f'style="float:left; margin:0 8px 4px 0; border:1px solid #444;"/></a>'
+    ) if png else ""
+    meta = block + (f' · {matched}' if matched else '') + (f' · rrf={rrf_str}' if rrf_str else '')
+    return (
+        f'<div style="margin:8px 0; padding:6px; border-top:1px solid #333; overflow:hidden;">'
+        + img_tag
+        + f'<b>Bild {slide_num} — {lecture}</b>'
+        f'<br><small style="color:#888;">{meta}</small>'
+        f'<br><small>{ai_esc}…</small>'
+        f'<div style="clear:both;"></div>'
+        f'</div>'
+    )
+
+
+def _img_fragment(img: dict) -> str:
+    local = img.get("local_path", "")
+    src_url = html_module.escape(img.get("source", img.get("url", "")))
+    if local:
+        file_url = html_module.escape(f"file://{local}")
+        return (
+            f'<a href="{src_url}">'
+            f'<img src="{file_url}" width="160" '
+            f'style="border:1px solid #444; margin:2px;"/></a>'
+        )
+    title = html_module.escape(img.get("title", "Bild") or "Bild")
+    return f'<a href="{src_url}">{title}</a> '
+
+
+def _vid_fragment(vid: dict) -> str:
+    title = html_module.escape(vid.get("title", "Video"))
+    url = html_module.escape(vid["url"])
+    return f'<li><a href="{url}">{title}</a></li>'
+
+
+def _link_fragment(lnk: dict) -> str:
+    title = html_module.escape(lnk.get("title", lnk["url"]))
+    url = html_module.escape(lnk["url"])
+    snippet = html_module.escape(lnk.get("snippet", ""))[:150]
+    if snippet:
+        return f'<li><a href="{url}">{title}</a><br><small style="color:#888;">{snippet}</small></li>'
+    return f'<li><a href="{url}">{title}</a></li>'
+
 
 def _cfg():
     return mw.addonManager.getConfig(__name__) or {}
@@ -55,9 +127,20 @@ class ResourcesTab(QWidget):
         self._images: list[dict] = []
         self._videos: list[dict] = []
         self._links: list[dict] = []
-        self._slides: list[dict] = []
+        # Escaped HTML for each bucket, built once when the bucket arrives
+        self._images_html = ""
+        self._videos_html = ""
+        self._links_html = ""
+        self._slides: list = []          # lecture_search.Slide records
+        self._errors: list[str] = []     # provider errors, shown below the results
         self._card_html: str = ""
         self._pending: int = 0  # counts running searches
+        self._rendered = False  # results rendered since the last search started
+        self._last_html = None  # HTML currently shown, None after results.clear()
+
+        self._render_timer = QTimer(self)
+        self._render_timer.setSingleShot(True)
+        self._render_timer.timeout.connect(self._render)
 
     def set_query(self, query: str, card_html: str = ""):
         """Pre-fill search box and store raw card HTML for MCQ detection."""
@@ -65,29 +148,27 @@ class ResourcesTab(QWidget):
         self._card_html = card_html
 
     def _on_search(self):
-        import os
-        _log_path = os.path.expanduser("~/ankihack_debug.log")
-        def _dbg(msg):
-            with open(_log_path, "a") as f:
-                f.write(f"[search] {msg}\n")
-
         query = self.search_input.text().strip()
-        _dbg(f"_on_search called, query={query!r}")
+        log.debug("[search] _on_search called, query=%r", query)
         if not query:
             return
         self._images = []
         self._videos = []
         self._links = []
         self._slides = []
+        self._errors = []
+        self._render_timer.stop()
+        self._rendered = False
+        self._last_html = None
         self.results.clear()
         self.status_label.setText("Söker...")
         self._pending = 4  # lectures + images + videos + links
 
         try:
             from ..resources import search_all, search_lectures
-            _dbg("imports OK")
+            log.debug("[search] imports OK")
         except Exception as exc:
-            _dbg(f"import error: {exc}")
+            log.debug("[search] import error: %s", exc)
             self.results.setHtml(f"<p style='color:red;'>Import-fel: {html_module.escape(str(exc))}</p>")
             return
 
@@ -95,11 +176,11 @@ class ResourcesTab(QWidget):
             mw.taskman.run_on_main(fn)
 
         def _slides_cb(s):
-            _dbg(f"slides callback: {len(s)} results")
+            log.debug("[search] slides callback: %d results", len(s))
             _main(lambda: self._on_slides(s))
 
         def _err_cb(e):
-            _dbg(f"error callback: {e}")
+            log.debug("[search] error callback: %s", e)
             _main(lambda: self._on_error(e))
 
         search_lectures(
@@ -108,7 +189,7 @@ class ResourcesTab(QWidget):
             on_slides=_slides_cb,
             on_error=_err_cb,
         )
-        _dbg("search_lectures launched")
+        log.debug("[search] search_lectures launched")
 
         cfg = _cfg()
         search_all(
@@ -121,127 +202,94 @@ class ResourcesTab(QWidget):
             google_cse_api_key=cfg.get("google_cse_api_key", ""),
             google_cse_cx=cfg.get("google_cse_cx", ""),
         )
-        _dbg("search_all launched")
+        log.debug("[search] search_all launched")
+
+    def _schedule_render(self):
+        if not self._render_timer.isActive():
+            self._render_timer.start(_RENDER_DEBOUNCE_MS)
 
     def _render(self):
-        import os, traceback
-        _log_path = os.path.expanduser("~/ankihack_debug.log")
         try:
-            self._render_inner()
-        except Exception as exc:
-            with open(_log_path, "a") as f:
-                f.write(f"[render] EXCEPTION: {exc}\n{traceback.format_exc()}\n")
-
-    def _render_inner(self):
-        import os
-        _log_path = os.path.expanduser("~/ankihack_debug.log")
-        with open(_log_path, "a") as f:
-            f.write(f"[render] _render_inner: slides={len(self._slides)} imgs={len(self._images)} vids={len(self._videos)} links={len(self._links)}\n")
-        html = ""
+            log.debug("[render] _render() done, html len=%d", self._render_inner())
+        except Exception:
+            log.exception("[render] EXCEPTION")
+
+    def _render_inner(self) -> int:
+        """Rebuild the results HTML; returns its length for the debug log."""
+        log.debug(
+            "[render] _render_inner: slides=%d imgs=%d vids=%d links=%d",
+            len(self._slides), len(self._images), len(self._videos), len(self._links),
+        )
+        parts = []
 
         if self._slides:
-            html += "<h3 style='margin:6px 0 2px;'>🎓 Föreläsningsbilder</h3>"
-            for s in self._slides:
-                block = html_module.escape(s.get("block", "").replace("_", " "))
-                lecture = html_module.escape(s.get("lecture", "").replace("_", " "))
-                slide_num = s.get("slide_num", "?")
-                png = s.get("png_path", "")
-                matched = html_module.escape(", ".join(s.get("matched_by", [])))
-                rrf = s.get("rrf_score")
-                rrf_str = f"{rrf:.3f}" if rrf else ""
-
-                ai = re.sub(r'[#*_`]', '', s.get("ai_txt", "") or s.get("slide_txt", ""))
-                ai = ai.replace("\n", " ").strip()[:200]
-                ai_esc = html_module.escape(ai)
-
-                file_url = f"file://{png}" if png else ""
-                img_tag = (
-                    f'<a href="{html_module.escape(file_url)}">'
-                    f'<img src="{html_module.escape(file_url)}" width="200" '
-                    f'style="float:left; margin:0 8px 4px 0; border:1px solid #444;"/></a>'
-                ) if png else ""
-                meta = block + (f' · {matched}' if matched else '') + (f' · rrf={rrf_str}' if rrf_str else '')
-                html += (
-                    f'<div style="margin:8px 0; padding:6px; border-top:1px solid #333; overflow:hidden;">'
-                    + img_tag
-                    + f'<b>Bild {slide_num} — {lecture}</b>'
-                    f'<br><small style="color:#888;">{meta}</small>'
-                    f'<br><small>{ai_esc}…</small>'
-                    f'<div style="clear:both;"></div>'
-                    f'</div>'
-                )
+            parts.append("<h3 style='margin:6px 0 2px;'>🎓 Föreläsningsbilder</h3>")
+            parts.extend(_slide_html(s) for s in self._slides)
 
         if self._images:
-            html += "<h3 style='margin:6px 0 2px;'>🖼 Bilder</h3>"
-            html += "<div style='display:flex; flex-wrap:wrap; gap:6px;'>"
-            for img in self._images:
-                local = img.get("local_path", "")
-                src_url = html_module.escape(img.get("source", img.get("url", "")))
-                if local:
-                    file_url = html_module.escape(f"file://{local}")
-                    html += (
-                        f'<a href="{src_url}">'
-                        f'<img src="{file_url}" width="160" '
-                        f'style="border:1px solid #444; margin:2px;"/></a>'
-                    )
-                else:
-                    title = html_module.escape(img.get("title", "Bild") or "Bild")
-                    html += f'<a href="{src_url}">{title}</a> '
-            html += "</div>"
+            parts.append("<h3 style='margin:6px 0 2px;'>🖼 Bilder</h3>")
+            parts.append("<div style='display:flex; flex-wrap:wrap; gap:6px;'>")
+            parts.append(self._images_html)
+            parts.append("</div>")
 
         if self._videos:
-            html += "<h3 style='margin:6px 0 2px;'>▶ YouTube-videos</h3><ul>"
-            for vid in self._videos:
-                title = html_module.escape(vid.get("title", "Video"))
-                url = html_module.escape(vid["url"])
-                html += f'<li><a href="{url}">{title}</a></li>'
-            html += "</ul>"
+            parts.append("<h3 style='margin:6px 0 2px;'>▶ YouTube-videos</h3><ul>")
+            parts.append(self._videos_html)
+            parts.append("</ul>")
 
         if self._links:
-            html += "<h3 style='margin:6px 0 2px;'>📚 Utbildningslänkar</h3><ul>"
-            for lnk in self._links[:6]:
-                title = html_module.escape(lnk.get("title", lnk["url"]))
-                url = html_module.escape(lnk["url"])
-                snippet = html_module.escape(lnk.get("snippet", ""))[:150]
-                html += f'<li><a href="{url}">{title}</a>'
-                if snippet:
-                    html += f'<br><small style="color:#888;">{snippet}</small>'
-                html += "</li>"
-            html += "</ul>"
-
-        self.results.setHtml(html or "<p style='color:#888;'>Inga resultat än.</p>")
+            parts.append("<h3 style='margin:6px 0 2px;'>📚 Utbildningslänkar</h3><ul>")
+            parts.append(self._links_html)
+            parts.append("</ul>")
+
+        if not parts and not self._errors:
+            parts.append("<p style='color:#888;'>Inga resultat än.</p>")
+        parts.extend(
+            f"<p style='color:#f44;'>{html_module.escape(err)}</p>" for err in self._errors
+        )
+
+        html = "".join(parts)
+        if html != self._last_html:
+            self._last_html = html
+            self.results.setHtml(html)
+        self._rendered = True
+        return len(html)
 
     def _on_link_clicked(self, url):
-        from aqt.qt import QUrl, QDesktopServices
         QDesktopServices.openUrl(QUrl(url.toString()))
 
     def _on_slides(self, slides):
-        import os
-        with open(os.path.expanduser("~/ankihack_debug.log"), "a") as f:
-            f.write(f"[render] _on_slides called, {len(slides)} slides\n")
-        self._slides = slides
-        self._render()
-        with open(os.path.expanduser("~/ankihack_debug.log"), "a") as f:
-            f.write(f"[render] _render() done, html len={len(self.results.toHtml())}\n")
+        log.debug("[render] _on_slides called, %d slides", len(slides))
+        if slides != self._slides or not self._rendered:
+            self._slides = slides
+            self._schedule_render()
         self._check_done()
 
     def _on_images(self, imgs):
-        self._images = imgs
-        self._render()
+        if imgs != self._images or not self._rendered:
+            self._images = imgs
+            self._images_html = "".join(_img_fragment(x) for x in imgs)
+            self._schedule_render()
         self._check_done()
 
     def _on_videos(self, vids):
-        self._videos = vids
-        self._render()
+        if vids != self._videos or not self._rendered:
+            self._videos = vids
+            self._videos_html = "".join(_vid_fragment(x) for x in vids)
+            self._schedule_render()
         self._check_done()
 
     def _on_links(self, lnks):
-        self._links = lnks
-        self._render()
+        if lnks != self._links or not self._rendered:
+            self._links = lnks
+            self._links_html = "".join(_link_fragment(x) for x in lnks[:6])
+            self._schedule_render()
         self._check_done()
 
     def _on_error(self, err: str):
-        self.results.append(f"<p style='color:#f44;'>{html_module.escape(err)}</p>")
+        # Kept with the results so a pending debounced render can't wipe it
+        self._errors.append(err)
+        self._schedule_render()
         self._check_done()
 
     def _check_done(self):
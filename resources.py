@@ -25,10 +25,11 @@ _GOOGLE_MIN_INTERVAL = 4.0
 def search_lectures(
     query: str,
     card_html: str,
-    on_slides: Callable[[list[dict]], None],
+    on_slides: Callable[[list], None],   # list of lecture_search.Slide
     on_error: Callable[[str], None],
 ):
-    """Search local lecture index. Detects MCQ and uses RRF fusion if applicable."""
+    """Search local lecture index. MCQ cards get a single fused BM25 query
+    over question and options (RRF fusion only with ACP_RRF=1)."""
     def _run():
         try:
             from .lecture_search import search_mcq, search_slides, parse_mcq
@@ -35,6 +35,26 @@ SYSTEM_PROMPT = (
 # Handler
 # ------------------------------------------------------------------
 
+# Field-name fragments identifying the "back" field, by note type
+_CLOZE_BACK_KEYWORDS = ("extra", "back")
+_BACK_KEYWORDS = ("back", "answer", "svar", "baksida")
+
+
+def _back_field_index(model: dict):
+    """Index of the field update_card_back should overwrite, or None."""
+    names = [f["name"].lower() for f in model["flds"]]
+    if model.get("type", 0) == 1:
+        keywords = _CLOZE_BACK_KEYWORDS
+        default = len(names) - 1 if len(names) > 1 else None
+    else:
+        keywords = _BACK_KEYWORDS
+        default = 1 if len(names) > 1 else None
+    return next(
+        (i for i, n in enumerate(names) if any(kw in n for kw in keywords)),
+        default,
+    )
+
+
 class ToolHandler:
     """Executes tool calls on the main Anki thread.
 
@@ -184,23 +204,7 @@ class ToolHandler:
         if not card:
             return
         note = card.note()
-        model = note.note_type()
-        field_names = [f["name"] for f in model["flds"]]
-        is_cloze = model.get("type", 0) == 1
-
-        if is_cloze:
-            idx = next(
-                (i for i, n in enumerate(field_names)
-                 if any(kw in n.lower() for kw in ("extra", "back"))),
-                len(field_names) - 1 if len(field_names) > 1 else None,
-            )
-        else:
-            idx = next(
-                (i for i, n in enumerate(field_names)
-                 if any(kw in n.lower() for kw in ("back", "answer", "svar", "baksida"))),
-                1 if len(field_names) > 1 else None,
-            )
-
+        idx = _back_field_index(note.note_type())
         if idx is None:
             return
 